@@ -6,21 +6,25 @@ Prometheus metrics, and saves a plot of resource usage over time.
 """
 
 import argparse
+import errno
+import sys
 import threading
 import time
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from dataclasses import dataclass
+from functools import lru_cache
 from subprocess import Popen
 from typing import List, Tuple, Callable, Optional
 import os
 from datetime import datetime
 
+import numpy as np
 import psutil
-import matplotlib.pyplot as plt
 
 
-@dataclass
+@dataclass(slots=True)
 class ProcessStats:
     memory: float
     cpu_percent: float
@@ -31,7 +35,11 @@ class ProcessStats:
 class OutputStrategy(ABC):
     @abstractmethod
     def output(self, stats: ProcessStats):
-        pass
+        """Output the latest stats.
+
+        The same `stats` object is updated in place for every sample,
+        so implementations must not hold on to it.
+        """
 
     @abstractmethod
     def cleanup(self):
@@ -39,18 +47,80 @@ class OutputStrategy(ABC):
 
 
 class ConsoleOutput(OutputStrategy):
+    """Strategy for console output.
+
+    Repaints the status line at most once every `min_interval` seconds,
+    regardless of the sampling frequency.  The last skipped sample is
+    written on cleanup, so that the final line is always up to date.
+    """
+
+    template = (
+        "\rMemory: {:.2f}MB | CPU: {:.2f}% | "
+        "I/O Read: {:.2f}MB | I/O Write: {:.2f}MB"
+    )
+
+    def __init__(self, min_interval: float = 0.1, time_func: Callable = time.monotonic):
+        self.min_interval = min_interval
+        self.time_func = time_func
+        self._last_output = float('-inf')
+        self._pending = None
+
     def output(self, stats: ProcessStats):
-        print(
-            f"\rMemory: {stats.memory:.2f}MB | CPU: {stats.cpu_percent:.2f}% | "
-            f"I/O Read: {stats.io_read:.2f}MB | I/O Write: {stats.io_write:.2f}MB",
-            end="",
-            flush=True,
-        )
+        # Copy the values, as the stats object is reused between samples.
+        values = (stats.memory, stats.cpu_percent, stats.io_read, stats.io_write)
+        now = self.time_func()
+        if now - self._last_output < self.min_interval:
+            self._pending = values
+            return
+        self._last_output = now
+        self._pending = None
+
+        sys.stdout.write(self.template.format(*values))
+        sys.stdout.flush()
 
     def cleanup(self):
+        if self._pending is not None:
+            sys.stdout.write(self.template.format(*self._pending))
+            self._pending = None
         print("\nMonitoring finished.")
 
 
+@lru_cache(maxsize=1)
+def _get_gauges(prometheus_client):
+    """Create the Prometheus gauges, once per process.
+
+    prometheus_client refuses to register metrics with the same name
+    twice, so all PrometheusOutput instances share these.
+    """
+    return (
+        prometheus_client.Gauge(
+            'process_memory_usage_mb', 'Memory usage of the process in MB'
+        ),
+        prometheus_client.Gauge(
+            'process_cpu_usage_percent', 'CPU usage of the process in percent'
+        ),
+        prometheus_client.Gauge('process_io_read_mb', 'I/O read of the process in MB'),
+        prometheus_client.Gauge(
+            'process_io_write_mb', 'I/O write of the process in MB'
+        ),
+    )
+
+
+def _gauge_setter(gauge) -> Callable[[float], None]:
+    """Return a function that sets the value of an unlabelled gauge.
+
+    Gauge.set() checks that the gauge is observable and converts the
+    value on every call, which we don't need for our plain float
+    gauges.  This reaches into the private `_value` attribute of
+    prometheus_client, so fall back to the public method if it's not
+    there.
+    """
+    value = getattr(gauge, '_value', None)
+    if value is None:
+        return gauge.set
+    return value.set
+
+
 class PrometheusOutput(OutputStrategy):
     """Strategy for Prometheus metrics output.
 
@@ -60,18 +130,16 @@ class PrometheusOutput(OutputStrategy):
     def __init__(self, port: int, prometheus_client):
         self.port = port
         self.prometheus_client = prometheus_client
-        self.memory_gauge = self.prometheus_client.Gauge(
-            'process_memory_usage_mb', 'Memory usage of the process in MB'
-        )
-        self.cpu_gauge = self.prometheus_client.Gauge(
-            'process_cpu_usage_percent', 'CPU usage of the process in percent'
-        )
-        self.io_read_gauge = self.prometheus_client.Gauge(
-            'process_io_read_mb', 'I/O read of the process in MB'
-        )
-        self.io_write_gauge = self.prometheus_client.Gauge(
-            'process_io_write_mb', 'I/O write of the process in MB'
-        )
+        (
+            self.memory_gauge,
+            self.cpu_gauge,
+            self.io_read_gauge,
+            self.io_write_gauge,
+        ) = _get_gauges(prometheus_client)
+        self._set_memory = _gauge_setter(self.memory_gauge)
+        self._set_cpu = _gauge_setter(self.cpu_gauge)
+        self._set_io_read = _gauge_setter(self.io_read_gauge)
+        self._set_io_write = _gauge_setter(self.io_write_gauge)
         self.server_thread = threading.Thread(target=self._start_server)
         self.server_thread.start()
         print(f"Prometheus server running on port {self.port}")
@@ -80,10 +148,10 @@ class PrometheusOutput(OutputStrategy):
         self.prometheus_client.start_http_server(self.port)
 
     def output(self, stats: ProcessStats):
-        self.memory_gauge.set(stats.memory)
-        self.cpu_gauge.set(stats.cpu_percent)
-        self.io_read_gauge.set(stats.io_read)
-        self.io_write_gauge.set(stats.io_write)
+        self._set_memory(stats.memory)
+        self._set_cpu(stats.cpu_percent)
+        self._set_io_read(stats.io_read)
+        self._set_io_write(stats.io_write)
 
     def cleanup(self):
         print("\nPrometheus server shutting down...")
@@ -108,6 +176,13 @@ class MultiOutput(OutputStrategy):
 
     def __init__(self, strategies: List[OutputStrategy]):
         self.strategies = strategies
+        # output() is called for every sample; skip the loop when
+        # there's nothing to fan out to.
+        if len(strategies) == 1:
+            self.output = strategies[0].output
+            self.cleanup = strategies[0].cleanup
+        elif not strategies:
+            self.output = self.cleanup = lambda *args: None
 
     def output(self, stats: ProcessStats):
         for strategy in self.strategies:
@@ -136,135 +211,561 @@ def get_output_strategy(use_console: bool, use_prometheus: bool, prometheus_port
         strategy.cleanup()
 
 
-def get_process_stats(
-    pid: int,
-) -> Optional[Tuple[float, Tuple[float, float], Tuple[int, int]]]:
-    """Get process statistics for a given process ID.
+class History:
+    """Fixed-capacity ring buffer of data points.
+
+    The capacity is rounded up to the next power of two so the write
+    index can wrap around with a bit mask.  Once full, the oldest data
+    points are overwritten.
+    """
+
+    def __init__(self, size: int, columns: int = 5):
+        capacity = 1 << max(size - 1, 0).bit_length()
+        self._buf = np.empty((capacity, columns), dtype=np.float64)
+        self._mask = capacity - 1
+        self._head = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, row):
+        self._buf[self._head] = row
+        self._head = (self._head + 1) & self._mask
+        if self._count <= self._mask:
+            self._count += 1
+
+    def to_array(self) -> np.ndarray:
+        """Return the data points in chronological order."""
+        if self._count <= self._mask:
+            return self._buf[: self._count].copy()
+        return np.roll(self._buf, -self._head, axis=0)
+
+
+MB = 1 / (1024 * 1024)  # Factor to convert bytes to megabytes
+
+# psutil attribute to read for each of the supported memory metrics.
+# USS requires walking the process's memory maps, which is a lot more
+# expensive than reading the RSS.
+MEMORY_ATTRS = {
+    'rss': 'memory_info',
+    'uss': 'memory_full_info',
+}
+
+
+# Placeholder that as_dict() returns for attributes it can't read.
+_UNAVAILABLE = object()
+
+
+def _read_process(
+    process: psutil.Process, attrs: List[str], memory_metric: Optional[str]
+) -> Tuple[float, float, float, float]:
+    """Read memory in bytes, CPU time, and bytes read and written.
+
+    Raises psutil.NoSuchProcess if any of the attributes can't be read
+    because the process is a zombie or access was denied.
+    """
+    # as_dict() fetches all attributes inside a single oneshot()
+    # context, so files under /proc are read once per process.
+    info = process.as_dict(attrs=attrs, ad_value=_UNAVAILABLE)
+    for value in info.values():
+        if value is _UNAVAILABLE:
+            raise psutil.NoSuchProcess(process.pid)
+    cpu_times = info['cpu_times']
+    io_counters = info['io_counters']
+    memory = 0.0
+    if memory_metric is not None:
+        memory = getattr(info[MEMORY_ATTRS[memory_metric]], memory_metric)
+    return (
+        memory,
+        cpu_times.user
+        + cpu_times.system
+        + cpu_times.children_user
+        + cpu_times.children_system,
+        io_counters.read_bytes,
+        io_counters.write_bytes,
+    )
+
+
+_RSS_ATTRS = ['cpu_times', 'io_counters', 'memory_info']
+
+
+class ProcReader:
+    """Reads RSS, CPU time, and I/O of processes directly from /proc.
+
+    This is a Linux-only fast path for what psutil's memory_info(),
+    cpu_times(), and io_counters() report, without psutil's per-call
+    object construction.  The /proc files of up to `max_open`
+    processes are kept open between samples and re-read with pread().
+    By default, that's as many as fit into a quarter of the file
+    descriptor limit, and no more than 256.  When we run out of file
+    descriptors anyway, psutil does the reading.
+    """
+
+    def __init__(self, max_open: Optional[int] = None):
+        if max_open is None:
+            import resource
+
+            limit, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+            max_open = 256
+            if limit != resource.RLIM_INFINITY:
+                max_open = min(max_open, limit // 4 // 3)  # Three files each
+        self.max_open = max_open
+        self._fds = {}
+        self._page_size = os.sysconf('SC_PAGE_SIZE')
+        self._clock_ticks = os.sysconf('SC_CLK_TCK')
+
+    def _open(self, pid: int) -> List[int]:
+        fds = []
+        try:
+            for name in ('stat', 'statm', 'io'):
+                fds.append(os.open(f'/proc/{pid}/{name}', os.O_RDONLY))
+        except OSError as e:
+            self._close(fds)
+            # Like _read_process, treat processes we can't read as gone.
+            if isinstance(e, (FileNotFoundError, PermissionError)):
+                raise psutil.NoSuchProcess(pid) from None
+            raise
+        return fds
+
+    @staticmethod
+    def _close(fds: List[int]):
+        for fd in fds:
+            os.close(fd)
+
+    def read(self, pid: int) -> Tuple[float, float, float, float]:
+        """Read RSS in bytes, CPU time, and bytes read and written."""
+        fds = self._fds.get(pid)
+        cached = fds is not None
+        if not cached:
+            try:
+                fds = self._open(pid)
+            except OSError as e:
+                if e.errno not in (errno.EMFILE, errno.ENFILE):
+                    raise
+                return _read_process(psutil.Process(pid), _RSS_ATTRS, 'rss')
+            if len(self._fds) < self.max_open:
+                self._fds[pid] = fds
+                cached = True
+
+        try:
+            stat = os.pread(fds[0], 4096, 0)
+            statm = os.pread(fds[1], 4096, 0)
+            io = os.pread(fds[2], 4096, 0)
+        except (ProcessLookupError, PermissionError):
+            # The process is gone, or we may no longer read its io file
+            # (after a setuid exec, say); treat both alike.  Open files
+            # don't follow a reused pid.
+            self._fds.pop(pid, None)
+            cached = False
+            raise psutil.NoSuchProcess(pid) from None
+        finally:
+            if not cached:
+                self._close(fds)
+
+        # The command name in parentheses may contain spaces, so split
+        # what comes after it.  utime, stime, cutime, and cstime are
+        # fields 14 to 17 of the stat file.
+        fields = stat[stat.rindex(b')') + 2 :].split()
+        cpu_time = (
+            int(fields[11]) + int(fields[12]) + int(fields[13]) + int(fields[14])
+        ) / self._clock_ticks
+        rss = int(statm.split()[1]) * self._page_size
+        # The io file consists of "name: value" lines; read_bytes and
+        # write_bytes are the fifth and sixth.
+        io_fields = io.split()
+        return rss, cpu_time, int(io_fields[9]), int(io_fields[11])
+
+    def retain(self, pids):
+        """Close the files of all processes not in `pids`."""
+        for pid in set(self._fds) - set(pids):
+            self._close(self._fds.pop(pid))
+
+    def close(self):
+        self.retain(())
+
+
+# Number of children up to which get_process_stats reads their USS one
+# after another instead of handing them to a thread pool.
+SERIAL_READ_LIMIT = 4
+
+
+@lru_cache(maxsize=1)
+def _get_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=8)
+
+
+def _rescan_children(
+    process: psutil.Process,
+    children: List[psutil.Process],
+    proc_reader: Optional[ProcReader],
+) -> List[psutil.Process]:
+    """Re-populate `children` in place and return the newly found ones."""
+    known = set(children)
+    children[:] = process.children(recursive=True)
+    if proc_reader is not None:
+        proc_reader.retain([process.pid] + [c.pid for c in children])
+    return [child for child in children if child not in known]
+
 
-    Returns memory usage, CPU times, and I/O counters.
+def get_process_stats(
+    process: psutil.Process,
+    children: List[psutil.Process],
+    refresh: bool = False,
+    memory_metric: Optional[str] = 'rss',
+    proc_reader: Optional[ProcReader] = None,
+) -> Optional[Tuple[Optional[float], float, float, float, float]]:
+    """Get process statistics for a process and its children.
+
+    `children` is a cache of the process's descendants.  It's
+    re-populated in place when `refresh` is true or when one of the
+    cached children has gone away.
+
+    `memory_metric` is one of the keys of `MEMORY_ATTRS`, or None to
+    skip reading memory altogether, in which case memory is None.
+
+    If a `proc_reader` is given, it's used instead of psutil to read
+    everything but USS.
+
+    Returns memory usage in MB, total CPU time in seconds, and bytes
+    read and written, summed over the process and its children.  The
+    last item is the CPU time that children newly found by this call
+    had already used before; it's part of the total CPU time, but
+    wasn't used since the previous sample.
     """
+    if proc_reader is not None and memory_metric != 'uss':
+
+        def read_one(process):
+            return proc_reader.read(process.pid)
+
+    else:
+        attrs = ['cpu_times', 'io_counters']
+        if memory_metric is not None:
+            attrs.append(MEMORY_ATTRS[memory_metric])
+
+        def read_one(process):
+            return _read_process(process, attrs, memory_metric)
+
+    def read(child):
+        try:
+            return read_one(child)
+        except psutil.NoSuchProcess:
+            return None
+
+    def read_all(children):
+        # Walking the memory maps for USS is spent mostly in the kernel
+        # with the GIL released, so for larger process trees those
+        # reads are done concurrently.  The cheap reads for RSS aren't
+        # worth the hand-off to another thread.
+        if memory_metric == 'uss' and len(children) > SERIAL_READ_LIMIT:
+            return list(_get_executor().map(read, children))
+        return [read(child) for child in children]
+
+    found = []
     try:
-        process = psutil.Process(pid)
-        with process.oneshot():
-            memory = process.memory_full_info().uss / 1024 / 1024  # MB
-            cpu_times = process.cpu_times()
-            io_counters = process.io_counters()
-
-        children = process.children(recursive=True)
-        for child in children:
-            with child.oneshot():
-                memory += child.memory_full_info().uss / 1024 / 1024
-                cpu_times = tuple(sum(x) for x in zip(cpu_times, child.cpu_times()))
-                io_counters = tuple(
-                    sum(x) for x in zip(io_counters, child.io_counters())
-                )
-
-        return memory, cpu_times, io_counters
+        rows = [read_one(process)]
+        if refresh:
+            found = _rescan_children(process, children, proc_reader)
     except psutil.NoSuchProcess:
         return None
 
+    found_cpu_time = 0.0
+    unread = list(children)
+    rescanned = refresh
+    while unread:
+        gone = False
+        for child, row in zip(unread, read_all(unread)):
+            if row is None:
+                children.remove(child)
+                gone = True
+            else:
+                rows.append(row)
+                if child in found:
+                    found_cpu_time += row[1]
+
+        # A child that went away is often followed by a new one, so
+        # look for those right away rather than at the next refresh:
+        unread = []
+        if gone and not rescanned:
+            rescanned = True
+            try:
+                found = unread = _rescan_children(process, children, proc_reader)
+            except psutil.NoSuchProcess:
+                return None
+
+    # Sum the (processes x counters) matrix in a single reduction.
+    memory, cpu_time, io_read, io_write = np.add.reduce(
+        np.array(rows, dtype=np.float64), axis=0
+    ).tolist()
+
+    if memory_metric is None:
+        memory = None
+    else:
+        memory *= MB
+    return memory, cpu_time, io_read, io_write, found_cpu_time
+
 
 def monitor_process(
     command: List[str],
     output_strategy: OutputStrategy,
     popen_func: Callable = Popen,
-    time_func: Callable = time.time,
+    time_func: Callable = time.monotonic,
     sleep_func: Callable = time.sleep,
     frequency: float = 10.0,
-):
+    history: int = 86400,
+    children_interval: float = 0.25,
+    memory_metric: str = 'rss',
+    adaptive: bool = False,
+) -> np.ndarray:
     """Monitor the resource usage of a process.
 
     Collects and outputs process statistics at specified frequency.
+    The list of child processes is refreshed every `children_interval`
+    seconds and whenever a child goes away.  CPU time that a child used
+    before it was found isn't counted as used in the current interval.
+    The expensive USS memory metric is read at most once per second and
+    carried forward in between.
+
+    On Linux, counters are read from /proc directly rather than through
+    psutil, except for USS.
+
+    Samples are scheduled against absolute deadlines on a monotonic
+    clock, so the time spent taking a sample doesn't add up as drift.
+    With `adaptive`, the sampling period grows by 25% per sample, up to
+    one second, while CPU and memory stay flat, and snaps back to
+    `1 / frequency` as soon as either changes.  While the period is
+    stretched, it can take up to a second to notice that the process
+    has exited.
+
+    Returns up to the last `history` data points as an array with
+    columns time, memory, CPU, I/O read, and I/O write.
     """
     process = popen_func(command)
-    pid = process.pid
+    ps_process = psutil.Process(process.pid)
+    children = []
+    proc_reader = ProcReader() if psutil.LINUX else None
 
     start_time = time_func()
-    last_cpu_times = None
+    last_cpu_time = None
+    cpu_offset = 0.0
+    last_memory = 0.0
     last_time = start_time
-    data_points = []
+    base_period = 1.0 / frequency
+    max_period = max(base_period, 1.0)
+    period = base_period
+    next_time = start_time
+    next_uss_time = start_time
+    next_children_time = start_time
+    data_points = History(history)
+    stats = ProcessStats(memory=0.0, cpu_percent=0.0, io_read=0.0, io_write=0.0)
 
     try:
         while process.poll() is None:
             current_time = time_func()
-            process_stats = get_process_stats(pid)
+            if memory_metric == 'uss' and current_time < next_uss_time:
+                metric = None
+            else:
+                metric = memory_metric
+                next_uss_time = current_time + 1.0
+            refresh = current_time >= next_children_time
+            if refresh:
+                next_children_time = current_time + children_interval
+            process_stats = get_process_stats(
+                ps_process,
+                children,
+                refresh=refresh,
+                memory_metric=metric,
+                proc_reader=proc_reader,
+            )
 
             if process_stats is None:
                 break
 
-            memory, cpu_times, io_counters = process_stats
+            memory, cpu_time, io_read, io_write, found_cpu_time = process_stats
+            # Children are only looked for now and then.  Don't count what
+            # they used before we found them as used in this interval.
+            cpu_offset += found_cpu_time
+            cpu_time -= cpu_offset
+            if memory is None:
+                memory = last_memory
+            last_memory = memory
 
-            if last_cpu_times is not None:
+            if last_cpu_time is not None:
                 time_diff = max(
                     current_time - last_time, 1e-6
                 )  # Avoid division by zero
-                cpu_percent = (sum(cpu_times) - sum(last_cpu_times)) / time_diff * 100
+                cpu_percent = (cpu_time - last_cpu_time) / time_diff * 100
             else:
-                cpu_percent = 0
+                cpu_percent = 0.0
 
-            last_cpu_times = cpu_times
+            last_cpu_time = cpu_time
             last_time = current_time
 
-            stats = ProcessStats(
-                memory=memory,
-                cpu_percent=cpu_percent,
-                io_read=io_counters[0] / 1024 / 1024,  # MB
-                io_write=io_counters[1] / 1024 / 1024,  # MB
-            )
-
-            relative_time = current_time - start_time
+            io_read *= MB
+            io_write *= MB
             data_points.append(
-                (
-                    relative_time,
-                    stats.memory,
-                    stats.cpu_percent,
-                    stats.io_read,
-                    stats.io_write,
-                )
+                (current_time - start_time, memory, cpu_percent, io_read, io_write)
             )
 
+            if adaptive:
+                # stats still holds the previous sample at this point.
+                if (
+                    abs(cpu_percent - stats.cpu_percent) < 1
+                    and abs(memory - stats.memory) < 1
+                ):
+                    period = min(period * 1.25, max_period)
+                else:
+                    period = base_period
+
+            stats.memory = memory
+            stats.cpu_percent = cpu_percent
+            stats.io_read = io_read
+            stats.io_write = io_write
             output_strategy.output(stats)
 
-            sleep_func(1.0 / frequency)
+            next_time += period
+            delay = next_time - time_func()
+            if delay > 0:
+                sleep_func(delay)
+            else:
+                next_time -= delay  # Fell behind; don't try to catch up
     except KeyboardInterrupt:
         pass
+    finally:
+        if proc_reader is not None:
+            proc_reader.close()
 
-    return data_points
+    return data_points.to_array()
 
 
-def plot_stats(
-    data_points: List[Tuple[float, float, float, float, float]], output_file: str
-):
-    """Plot the collected process statistics and save to a file."""
-    if not data_points:
+def _minmax_indices(y: np.ndarray, n_buckets: int) -> np.ndarray:
+    """Indices of the first and last point plus the minimum and maximum
+    of `y` in each of `n_buckets` equally sized buckets in between.
+    """
+    n = len(y)
+    size = (n - 2) // n_buckets
+    end = 1 + size * n_buckets
+    buckets = y[1:end].reshape(n_buckets, size)
+    offsets = np.arange(1, end, size)
+    return np.unique(
+        np.concatenate(
+            (
+                [0],
+                offsets + buckets.argmin(axis=1),
+                offsets + buckets.argmax(axis=1),
+                np.arange(end, n),  # Remainder, including the last point
+            )
+        )
+    )
+
+
+def _lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Downsample a series with Largest-Triangle-Three-Buckets.
+
+    Returns the indices of the (at most) `n_out` points to keep.  Long
+    series are first reduced to the minima and maxima of `3 * n_out`
+    buckets, which keeps the peaks while making the LTTB pass
+    independent of the input length.
+    """
+    n = len(x)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+
+    if n > 10 * n_out:
+        preselected = _minmax_indices(y, 3 * n_out)
+        return preselected[_lttb(x[preselected], y[preselected], n_out)]
+
+    # The first and last point are always kept; the points in between
+    # are split into n_out - 2 buckets, each contributing one point.
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.intp)
+    indices = np.empty(n_out, dtype=np.intp)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[end : edges[i + 2]].mean()
+            next_y = y[end : edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        # Pick the point forming the largest triangle with the previously
+        # selected point and the average of the next bucket:
+        areas = np.abs(
+            (x[a] - next_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (next_y - y[a])
+        )
+        a = start + int(areas.argmax())
+        indices[i + 1] = a
+    return indices
+
+
+@lru_cache(maxsize=1)
+def _get_figure():
+    """Create the figure used by plot_stats, once per process."""
+    # matplotlib is slow to import, so only pay for it once monitoring
+    # is done.  We only ever write files, hence the Agg backend.
+    import matplotlib
+
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, _ = plt.subplots(3, 1, figsize=(10, 15), sharex=True)
+    return fig
+
+
+def plot_stats(data_points: np.ndarray, output_file: str, max_points: int = 2000):
+    """Plot the collected process statistics and save to a file.
+
+    Each series is downsampled to at most `max_points` points, which is
+    plenty for the resolution of the plot.
+    """
+    if len(data_points) == 0:
         print("No data to plot.")
         return
 
-    times = [point[0] for point in data_points]
-    memories = [point[1] for point in data_points]
-    cpus = [point[2] for point in data_points]
-    io_reads = [point[3] for point in data_points]
-    io_writes = [point[4] for point in data_points]
+    data = np.asarray(data_points, dtype=np.float64)
+    times, memories, cpus, io_reads, io_writes = data.T
+
+    fig = _get_figure()
+    ax1, ax2, ax3 = fig.axes
+    for ax in fig.axes:
+        ax.clear()
 
-    fig, (ax1, ax2, ax3) = plt.subplots(3, 1, figsize=(10, 15), sharex=True)
+    def plot(ax, y, label):
+        indices = _lttb(times, y, max_points)
+        ax.plot(times[indices], y[indices], label=label)
 
-    ax1.plot(times, memories, label='Memory (MB)')
+    plot(ax1, memories, 'Memory (MB)')
     ax1.set_ylabel('Memory (MB)')
     ax1.legend()
 
-    ax2.plot(times, cpus, label='CPU (%)')
+    plot(ax2, cpus, 'CPU (%)')
     ax2.set_ylabel('CPU (%)')
     ax2.legend()
 
-    ax3.plot(times, io_reads, label='I/O Read (MB)')
-    ax3.plot(times, io_writes, label='I/O Write (MB)')
+    plot(ax3, io_reads, 'I/O Read (MB)')
+    plot(ax3, io_writes, 'I/O Write (MB)')
     ax3.set_xlabel('Time (s)')
     ax3.set_ylabel('I/O (MB)')
     ax3.legend()
 
-    plt.tight_layout()
-    plt.savefig(output_file)
-    plt.close(fig)
+    fig.tight_layout()
+
+    # Write to a temporary file first so that the plot appears
+    # atomically.  For PNGs, trade some file size for a much faster zlib
+    # compression level.
+    root, ext = os.path.splitext(output_file)
+    tmp_file = f"{root}.tmp{ext}"
+    kwargs = {}
+    if ext.lower() == '.png':
+        kwargs['pil_kwargs'] = {'compress_level': 1}
+    try:
+        fig.savefig(tmp_file, dpi=80, **kwargs)
+        os.replace(tmp_file, output_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
 
     print(f"Plot saved to {output_file}")
 
@@ -280,6 +781,27 @@ def main():
         default=10.0,
         help="Log stats with this frequency (Hz)",
     )
+    parser.add_argument(
+        '--history',
+        type=int,
+        default=86400,
+        help="Number of most recent data points to keep for the plot "
+        "(rounded up to a power of two)",
+    )
+    parser.add_argument(
+        '--memory-metric',
+        choices=sorted(MEMORY_ATTRS),
+        default='rss',
+        help="Memory metric to report; USS is more accurate but more "
+        "expensive to read and is sampled at most once per second",
+    )
+    parser.add_argument(
+        '--adaptive',
+        action='store_true',
+        help="Sample less often, down to once per second, while CPU and "
+        "memory usage don't change; noticing that the command has exited "
+        "can then take up to a second",
+    )
     parser.add_argument(
         '--no-console', action='store_true', help="Disable console output"
     )
@@ -303,9 +825,12 @@ def main():
             command=args.command,
             output_strategy=output_strategy,
             frequency=args.frequency,
+            history=args.history,
+            memory_metric=args.memory_metric,
+            adaptive=args.adaptive,
         )
 
-    if not data_points:
+    if len(data_points) == 0:
         print(
             "No data collected. The monitored process may have crashed or finished too quickly."
         )
@@ -1,7 +1,13 @@
+import errno
+import resource
 import sys
+from dataclasses import replace
 from io import StringIO
-from unittest.mock import Mock, patch, call
+from subprocess import Popen
+from unittest.mock import ANY, Mock, patch
 
+import numpy as np
+import psutil
 import pytest
 
 from silly import (
@@ -9,12 +15,30 @@ from silly import (
     ConsoleOutput,
     PrometheusOutput,
     MultiOutput,
+    History,
+    ProcReader,
     get_process_stats,
     monitor_process,
     get_output_strategy,
+    plot_stats,
+    _get_figure,
+    _lttb,
 )
 
 
+def mock_cpu_times(user, system, children_user=0.0, children_system=0.0):
+    return Mock(
+        user=user,
+        system=system,
+        children_user=children_user,
+        children_system=children_system,
+    )
+
+
+def mock_io_counters(read_bytes, write_bytes):
+    return Mock(read_bytes=read_bytes, write_bytes=write_bytes)
+
+
 class MockPrometheusClient:
     def __init__(self):
         self.Gauge = Mock()
@@ -27,6 +51,7 @@ def test_process_stats():
     assert stats.cpu_percent == 50.0
     assert stats.io_read == 10.0
     assert stats.io_write == 5.0
+    assert not hasattr(stats, '__dict__')
 
 
 def test_console_output():
@@ -44,6 +69,47 @@ def test_console_output():
     assert "I/O Read: 10.00MB | I/O Write: 5.00MB" in captured_output.getvalue()
 
 
+def test_console_output_rate_limited():
+    mock_time = Mock(side_effect=[0.0, 0.05, 0.1, 0.15])
+    console_output = ConsoleOutput(min_interval=0.1, time_func=mock_time)
+
+    captured_output = StringIO()
+    sys.stdout = captured_output
+
+    for memory in [1.0, 2.0, 3.0, 4.0]:
+        stats = ProcessStats(memory=memory, cpu_percent=0.0, io_read=0.0, io_write=0.0)
+        console_output.output(stats)
+
+    sys.stdout = sys.__stdout__  # Reset redirect.
+
+    assert "Memory: 1.00MB" in captured_output.getvalue()
+    assert "Memory: 2.00MB" not in captured_output.getvalue()
+    assert "Memory: 3.00MB" in captured_output.getvalue()
+    assert "Memory: 4.00MB" not in captured_output.getvalue()
+
+
+def test_console_output_cleanup_writes_skipped_stats():
+    mock_time = Mock(side_effect=[0.0, 0.05])
+    console_output = ConsoleOutput(min_interval=0.1, time_func=mock_time)
+
+    captured_output = StringIO()
+    sys.stdout = captured_output
+
+    stats = ProcessStats(memory=1.0, cpu_percent=0.0, io_read=0.0, io_write=0.0)
+    console_output.output(stats)
+    stats.memory = 2.0
+    console_output.output(stats)
+    stats.memory = 3.0  # Changes after the last output don't show.
+    console_output.cleanup()
+
+    sys.stdout = sys.__stdout__  # Reset redirect.
+
+    assert captured_output.getvalue().endswith(
+        "\rMemory: 2.00MB | CPU: 0.00% | I/O Read: 0.00MB | I/O Write: 0.00MB"
+        "\nMonitoring finished.\n"
+    )
+
+
 def test_prometheus_output():
     mock_client = MockPrometheusClient()
     mock_client.Gauge.side_effect = [Mock(), Mock(), Mock(), Mock()]
@@ -56,14 +122,24 @@ def test_prometheus_output():
     stats = ProcessStats(memory=100.0, cpu_percent=50.0, io_read=10.0, io_write=5.0)
     prometheus_output.output(stats)
 
-    # Check that set was called on each Gauge
-    for gauge in [
-        prometheus_output.memory_gauge,
-        prometheus_output.cpu_gauge,
-        prometheus_output.io_read_gauge,
-        prometheus_output.io_write_gauge,
+    # Check that each Gauge's value was set
+    for gauge, value in [
+        (prometheus_output.memory_gauge, 100.0),
+        (prometheus_output.cpu_gauge, 50.0),
+        (prometheus_output.io_read_gauge, 10.0),
+        (prometheus_output.io_write_gauge, 5.0),
     ]:
-        gauge.set.assert_called_once()
+        gauge._value.set.assert_called_once_with(value)
+
+
+def test_prometheus_output_reuses_gauges():
+    mock_client = MockPrometheusClient()
+    first = PrometheusOutput(8000, mock_client)
+    second = PrometheusOutput(8000, mock_client)
+
+    assert mock_client.Gauge.call_count == 4
+    assert second.memory_gauge is first.memory_gauge
+    assert second.io_write_gauge is first.io_write_gauge
 
 
 def test_multi_output():
@@ -82,21 +158,255 @@ def test_multi_output():
     mock_strategy2.cleanup.assert_called_once()
 
 
-@patch('silly.psutil.Process')
-def test_get_process_stats(mock_process):
-    mock_process.return_value.memory_full_info.return_value.uss = 1024 * 1024  # 1 MB
-    mock_process.return_value.cpu_times.return_value = (1.0, 0.5)
-    mock_process.return_value.io_counters.return_value = (
-        1024 * 1024,
-        512 * 1024,
-    )  # 1 MB read, 0.5 MB write
-    mock_process.return_value.children.return_value = []
+@pytest.mark.parametrize("n_strategies", [0, 1])
+def test_multi_output_specialized(n_strategies):
+    mock_strategies = [Mock() for _ in range(n_strategies)]
+    multi_output = MultiOutput(mock_strategies)
 
-    stats = get_process_stats(12345)
+    stats = ProcessStats(memory=100.0, cpu_percent=50.0, io_read=10.0, io_write=5.0)
+    multi_output.output(stats)
+    multi_output.cleanup()
+
+    for mock_strategy in mock_strategies:
+        mock_strategy.output.assert_called_once_with(stats)
+        mock_strategy.cleanup.assert_called_once()
+
+
+def test_get_process_stats():
+    mock_process = Mock()
+    mock_process.as_dict.return_value = {
+        'memory_info': Mock(rss=1024 * 1024),  # 1 MB
+        'cpu_times': mock_cpu_times(1.0, 0.5, 0.25, 0.25),
+        # 1 MB read, 0.5 MB write
+        'io_counters': mock_io_counters(1024 * 1024, 512 * 1024),
+    }
+    mock_process.children.return_value = []
+
+    stats = get_process_stats(mock_process, [])
     assert stats is not None
     assert stats[0] == 1.0  # 1 MB memory
-    assert stats[1] == (1.0, 0.5)  # CPU times
-    assert stats[2] == (1024 * 1024, 512 * 1024)  # IO counters
+    assert stats[1] == 2.0  # CPU time
+    assert stats[2] == 1024 * 1024  # Bytes read
+    assert stats[3] == 512 * 1024  # Bytes written
+    mock_process.children.assert_not_called()
+
+
+def test_get_process_stats_children():
+    mock_process = Mock()
+    mock_process.as_dict.return_value = {
+        'memory_info': Mock(rss=1024 * 1024),
+        'cpu_times': mock_cpu_times(1.0, 0.5),
+        'io_counters': mock_io_counters(1024 * 1024, 512 * 1024),
+    }
+
+    mock_child = Mock()
+    mock_child.as_dict.return_value = {
+        'memory_info': Mock(rss=2 * 1024 * 1024),
+        'cpu_times': mock_cpu_times(0.5, 0.25),
+        'io_counters': mock_io_counters(1024, 512),
+    }
+
+    mock_dead_child = Mock()
+    mock_dead_child.as_dict.side_effect = psutil.NoSuchProcess(1)
+
+    mock_process.children.return_value = [mock_child, mock_dead_child]
+
+    children = []
+    stats = get_process_stats(mock_process, children, refresh=True)
+    assert stats == (3.0, 2.25, 1024 * 1024 + 1024, 512 * 1024 + 512, 0.75)
+    assert children == [mock_child]
+
+
+def test_get_process_stats_zombie_child():
+    mock_process = Mock()
+    mock_process.as_dict.return_value = {
+        'memory_info': Mock(rss=1024 * 1024),
+        'cpu_times': mock_cpu_times(1.0, 0.5),
+        'io_counters': mock_io_counters(1024, 512),
+    }
+
+    # as_dict() hands back its ad_value for attributes it couldn't read:
+    mock_zombie_child = Mock()
+    mock_zombie_child.as_dict.side_effect = lambda attrs, ad_value: {
+        'memory_info': ad_value,
+        'cpu_times': ad_value,
+        'io_counters': ad_value,
+    }
+
+    mock_process.children.return_value = []
+
+    children = [mock_zombie_child]
+    stats = get_process_stats(mock_process, children)
+    assert stats == (1.0, 1.5, 1024, 512, 0.0)
+    assert children == []
+
+
+def test_get_process_stats_rescans_when_child_gone():
+    mock_process = Mock()
+    mock_process.as_dict.return_value = {
+        'memory_info': Mock(rss=1024 * 1024),
+        'cpu_times': mock_cpu_times(1.0, 0.5),
+        'io_counters': mock_io_counters(0, 0),
+    }
+
+    mock_dead_child = Mock()
+    mock_dead_child.as_dict.side_effect = psutil.NoSuchProcess(1)
+    mock_new_child = Mock()
+    mock_new_child.as_dict.return_value = {
+        'memory_info': Mock(rss=1024 * 1024),
+        'cpu_times': mock_cpu_times(2.0, 1.0),
+        'io_counters': mock_io_counters(0, 0),
+    }
+    mock_process.children.return_value = [mock_new_child]
+
+    children = [mock_dead_child]
+    stats = get_process_stats(mock_process, children)
+    assert stats == (2.0, 4.5, 0, 0, 3.0)
+    assert children == [mock_new_child]
+
+
+def test_get_process_stats_many_children():
+    mock_process = Mock()
+    mock_process.as_dict.return_value = {
+        'memory_full_info': Mock(uss=1024 * 1024),
+        'cpu_times': mock_cpu_times(1.0, 0.5),
+        'io_counters': mock_io_counters(0, 0),
+    }
+
+    mock_children = []
+    for i in range(8):
+        mock_child = Mock()
+        mock_child.as_dict.return_value = {
+            'memory_full_info': Mock(uss=1024 * 1024),
+            'cpu_times': mock_cpu_times(0.5, 0.5),
+            'io_counters': mock_io_counters(1024, 512),
+        }
+        mock_children.append(mock_child)
+    mock_children[3].as_dict.side_effect = psutil.NoSuchProcess(1)
+
+    mock_process.children.return_value = mock_children[:3] + mock_children[4:]
+
+    children = list(mock_children)
+    stats = get_process_stats(mock_process, children, memory_metric='uss')
+    assert stats == (8.0, 8.5, 7 * 1024, 7 * 512, 0.0)
+    assert children == mock_children[:3] + mock_children[4:]
+
+
+def test_get_process_stats_proc_reader():
+    mock_process = Mock(pid=1)
+    mock_child = Mock(pid=2)
+    mock_dead_child = Mock(pid=3)
+    mock_process.children.return_value = [mock_child, mock_dead_child]
+
+    rows = {
+        1: (1024 * 1024, 1.5, 1024 * 1024, 512 * 1024),
+        2: (2 * 1024 * 1024, 0.75, 1024, 512),
+    }
+
+    def read(pid):
+        if pid not in rows:
+            raise psutil.NoSuchProcess(pid)
+        return rows[pid]
+
+    mock_reader = Mock()
+    mock_reader.read.side_effect = read
+
+    children = []
+    stats = get_process_stats(
+        mock_process, children, refresh=True, proc_reader=mock_reader
+    )
+    assert stats == (3.0, 2.25, 1024 * 1024 + 1024, 512 * 1024 + 512, 0.75)
+    assert children == [mock_child]
+    mock_reader.retain.assert_called_once_with([1, 2, 3])
+    mock_process.as_dict.assert_not_called()
+
+
+@pytest.mark.skipif(not psutil.LINUX, reason="requires /proc")
+def test_proc_reader():
+    process = psutil.Process()
+    proc_reader = ProcReader()
+    try:
+        rss, cpu_time, io_read, io_write = proc_reader.read(process.pid)
+        cpu_times = process.cpu_times()
+        io_counters = process.io_counters()
+        assert rss == pytest.approx(process.memory_info().rss, rel=0.1)
+        assert cpu_time <= sum(cpu_times[:4]) + 0.1
+        assert io_read <= io_counters.read_bytes
+        assert io_write <= io_counters.write_bytes
+        assert list(proc_reader._fds) == [process.pid]
+
+        proc_reader.retain([])
+        assert proc_reader._fds == {}
+    finally:
+        proc_reader.close()
+
+
+@pytest.mark.skipif(not psutil.LINUX, reason="requires /proc")
+@pytest.mark.parametrize(
+    "limit,expected_max_open",
+    [(1024, 85), (65536, 256), (resource.RLIM_INFINITY, 256)],
+)
+def test_proc_reader_max_open(limit, expected_max_open):
+    with patch('resource.getrlimit', return_value=(limit, limit)):
+        assert ProcReader().max_open == expected_max_open
+
+
+@pytest.mark.skipif(not psutil.LINUX, reason="requires /proc")
+def test_proc_reader_out_of_file_descriptors():
+    process = psutil.Process()
+    proc_reader = ProcReader()
+    emfile = OSError(errno.EMFILE, "Too many open files")
+    with patch('silly.os.open', side_effect=emfile):
+        rss, cpu_time, io_read, io_write = proc_reader.read(process.pid)
+    assert rss == pytest.approx(process.memory_info().rss, rel=0.1)
+    assert cpu_time <= sum(process.cpu_times()[:4])
+    assert proc_reader._fds == {}
+
+
+@pytest.mark.skipif(not psutil.LINUX, reason="requires /proc")
+def test_proc_reader_no_such_process():
+    process = Popen(['true'])
+    proc_reader = ProcReader()
+    proc_reader.read(process.pid)
+    process.wait()
+
+    with pytest.raises(psutil.NoSuchProcess):
+        proc_reader.read(process.pid)
+    assert proc_reader._fds == {}
+
+
+@pytest.mark.skipif(not psutil.LINUX, reason="requires /proc")
+def test_proc_reader_permission_denied():
+    pid = psutil.Process().pid
+    proc_reader = ProcReader()
+    proc_reader.read(pid)
+
+    with patch('silly.os.pread', side_effect=PermissionError(errno.EACCES, "")):
+        with pytest.raises(psutil.NoSuchProcess):
+            proc_reader.read(pid)
+    assert proc_reader._fds == {}
+
+
+@pytest.mark.parametrize(
+    "memory_metric,expected_attrs,expected_memory",
+    [
+        ('uss', ['cpu_times', 'io_counters', 'memory_full_info'], 1.0),
+        (None, ['cpu_times', 'io_counters'], None),
+    ],
+)
+def test_get_process_stats_memory_metric(
+    memory_metric, expected_attrs, expected_memory
+):
+    mock_process = Mock()
+    mock_process.as_dict.return_value = {
+        'memory_full_info': Mock(uss=1024 * 1024),
+        'cpu_times': mock_cpu_times(1.0, 0.5),
+        'io_counters': mock_io_counters(1024 * 1024, 512 * 1024),
+    }
+
+    stats = get_process_stats(mock_process, [], memory_metric=memory_metric)
+    mock_process.as_dict.assert_called_once_with(attrs=expected_attrs, ad_value=ANY)
+    assert stats[0] == expected_memory
 
 
 @pytest.mark.parametrize(
@@ -118,25 +428,30 @@ def test_get_output_strategy(use_console, use_prometheus, expected_strategies):
 
 
 def test_monitor_process():
+    # The stats object is reused between samples, so keep copies:
+    outputs = []
     mock_strategy = Mock()
+    mock_strategy.output.side_effect = lambda stats: outputs.append(replace(stats))
     mock_popen = Mock()
     mock_process = Mock()
     mock_process.poll.side_effect = [None, None, 0]  # Run twice, then exit
     mock_popen.return_value = mock_process
 
-    mock_time = Mock(side_effect=[0, 1, 2])  # Simulate time passing
+    mock_time = Mock(side_effect=[0, 1, 1, 2, 2])  # Simulate time passing
     mock_sleep = Mock()
 
     mock_get_stats = Mock(
         side_effect=[
-            (100.0, (1.0, 0.5), (1024 * 1024, 512 * 1024)),
-            (120.0, (1.5, 0.7), (1536 * 1024, 768 * 1024)),
+            (100.0, 1.5, 1024 * 1024, 512 * 1024, 0.0),
+            (120.0, 2.2, 1536 * 1024, 768 * 1024, 0.0),
             None,  # Simulate process ending
         ]
     )
 
-    with patch('silly.get_process_stats', mock_get_stats):
-        monitor_process(
+    with patch('silly.get_process_stats', mock_get_stats), patch(
+        'silly.psutil.Process'
+    ):
+        data_points = monitor_process(
             ['test_command'],
             mock_strategy,
             popen_func=mock_popen,
@@ -147,25 +462,272 @@ def test_monitor_process():
     assert mock_strategy.output.call_count == 2  # Called twice before process "exits"
     mock_popen.assert_called_with(['test_command'])
 
-    expected_calls = [
-        call(
-            ProcessStats(
-                memory=pytest.approx(100.0),
-                cpu_percent=pytest.approx(0.0),
-                io_read=pytest.approx(1.0),
-                io_write=pytest.approx(0.5),
-            )
+    assert outputs == [
+        ProcessStats(
+            memory=pytest.approx(100.0),
+            cpu_percent=pytest.approx(0.0),
+            io_read=pytest.approx(1.0),
+            io_write=pytest.approx(0.5),
         ),
-        call(
-            ProcessStats(
-                memory=pytest.approx(120.0),
-                cpu_percent=pytest.approx(70.0),
-                io_read=pytest.approx(1.5),
-                io_write=pytest.approx(0.75),
-            )
+        ProcessStats(
+            memory=pytest.approx(120.0),
+            cpu_percent=pytest.approx(70.0),
+            io_read=pytest.approx(1.5),
+            io_write=pytest.approx(0.75),
         ),
     ]
-    mock_strategy.output.assert_has_calls(expected_calls, any_order=False)
+
+    assert data_points.shape == (2, 5)
+    assert data_points[:, 0].tolist() == [1, 2]
+    assert data_points[:, 1].tolist() == [100.0, 120.0]
+
+
+@patch('silly.psutil.LINUX', False)
+def test_monitor_process_new_child():
+    mock_process = Mock()
+    mock_process.poll.side_effect = [None] * 4 + [0]
+    mock_popen = Mock(return_value=mock_process)
+
+    mock_ps_process = Mock()
+    mock_ps_process.as_dict.side_effect = [
+        {
+            'memory_info': Mock(rss=0),
+            'cpu_times': mock_cpu_times(cpu_time, 0.0),
+            'io_counters': mock_io_counters(0, 0),
+        }
+        for cpu_time in [1.0, 1.5, 2.0, 2.5]
+    ]
+    # The child starts between the first and second rescan, with five
+    # seconds of CPU time used by the time it's found:
+    mock_child = Mock()
+    mock_child.as_dict.side_effect = [
+        {
+            'memory_info': Mock(rss=0),
+            'cpu_times': mock_cpu_times(cpu_time, 0.0),
+            'io_counters': mock_io_counters(0, 0),
+        }
+        for cpu_time in [5.0, 5.5]
+    ]
+    mock_ps_process.children.side_effect = [[], [mock_child]]
+
+    outputs = []
+    mock_strategy = Mock()
+    mock_strategy.output.side_effect = lambda stats: outputs.append(replace(stats))
+
+    with patch('silly.psutil.Process', return_value=mock_ps_process):
+        monitor_process(
+            ['test_command'],
+            mock_strategy,
+            popen_func=mock_popen,
+            time_func=Mock(side_effect=[0, 1, 1, 2, 2, 3, 3, 4, 4]),
+            sleep_func=Mock(),
+            children_interval=2,
+        )
+
+    cpu_percents = [stats.cpu_percent for stats in outputs]
+    assert cpu_percents == [0.0, 50.0, 50.0, 100.0]
+
+
+def test_monitor_process_children_interval():
+    mock_process = Mock()
+    mock_process.poll.side_effect = [None] * 6 + [0]
+    mock_popen = Mock(return_value=mock_process)
+
+    sample_times = [0, 0.1, 0.2, 0.3, 1.0, 1.1]
+    mock_time = Mock(side_effect=[0] + [t for t in sample_times for _ in range(2)])
+    mock_get_stats = Mock(return_value=(100.0, 1.5, 0, 0, 0.0))
+
+    with patch('silly.get_process_stats', mock_get_stats), patch(
+        'silly.psutil.Process'
+    ):
+        monitor_process(
+            ['test_command'],
+            Mock(),
+            popen_func=mock_popen,
+            time_func=mock_time,
+            sleep_func=Mock(),
+            children_interval=0.25,
+        )
+
+    refreshes = [c.kwargs['refresh'] for c in mock_get_stats.call_args_list]
+    assert refreshes == [True, False, False, True, True, False]
+
+
+def test_monitor_process_uss():
+    mock_strategy = Mock()
+    mock_process = Mock()
+    mock_process.poll.side_effect = [None, None, 0]
+    mock_popen = Mock(return_value=mock_process)
+
+    mock_get_stats = Mock(
+        side_effect=[
+            (100.0, 1.5, 0, 0, 0.0),
+            (None, 2.2, 0, 0, 0.0),
+        ]
+    )
+
+    with patch('silly.get_process_stats', mock_get_stats), patch(
+        'silly.psutil.Process'
+    ):
+        data_points = monitor_process(
+            ['test_command'],
+            mock_strategy,
+            popen_func=mock_popen,
+            time_func=Mock(side_effect=[0, 0, 0, 0.5, 0.5]),
+            sleep_func=Mock(),
+            memory_metric='uss',
+        )
+
+    metrics = [c.kwargs['memory_metric'] for c in mock_get_stats.call_args_list]
+    assert metrics == ['uss', None]
+    assert data_points[:, 1].tolist() == [100.0, 100.0]
+
+
+def test_monitor_process_deadlines():
+    mock_process = Mock()
+    mock_process.poll.side_effect = [None, None, None, 0]
+    mock_popen = Mock(return_value=mock_process)
+
+    # Sampling takes 0.03s, 0.02s, and 0.15s (which misses a deadline):
+    mock_time = Mock(side_effect=[0, 0, 0.03, 0.1, 0.12, 0.2, 0.35])
+    mock_sleep = Mock()
+
+    mock_get_stats = Mock(return_value=(100.0, 1.5, 0, 0, 0.0))
+
+    with patch('silly.get_process_stats', mock_get_stats), patch(
+        'silly.psutil.Process'
+    ):
+        monitor_process(
+            ['test_command'],
+            Mock(),
+            popen_func=mock_popen,
+            time_func=mock_time,
+            sleep_func=mock_sleep,
+            frequency=10.0,
+        )
+
+    sleeps = [c.args[0] for c in mock_sleep.call_args_list]
+    assert sleeps == [pytest.approx(0.07), pytest.approx(0.08)]
+
+
+def test_monitor_process_adaptive():
+    mock_process = Mock()
+    mock_process.poll.side_effect = [None] * 5 + [0]
+    mock_popen = Mock(return_value=mock_process)
+
+    # Sampling takes no time at all:
+    current_time = 0.0
+
+    def sleep(delay):
+        nonlocal current_time
+        current_time += delay
+
+    mock_sleep = Mock(side_effect=sleep)
+
+    # Quiescent for three samples, then memory jumps:
+    mock_get_stats = Mock(
+        side_effect=[
+            (100.0, 0.0, 0, 0, 0.0),
+            (100.0, 0.0, 0, 0, 0.0),
+            (100.0, 0.0, 0, 0, 0.0),
+            (200.0, 0.0, 0, 0, 0.0),
+            (200.0, 0.0, 0, 0, 0.0),
+        ]
+    )
+
+    with patch('silly.get_process_stats', mock_get_stats), patch(
+        'silly.psutil.Process'
+    ):
+        monitor_process(
+            ['test_command'],
+            Mock(),
+            popen_func=mock_popen,
+            time_func=lambda: current_time,
+            sleep_func=mock_sleep,
+            frequency=10.0,
+            adaptive=True,
+        )
+
+    sleeps = [c.args[0] for c in mock_sleep.call_args_list]
+    assert sleeps == [
+        pytest.approx(0.1),
+        pytest.approx(0.125),
+        pytest.approx(0.15625),
+        pytest.approx(0.1),
+        pytest.approx(0.125),
+    ]
+
+
+def test_history():
+    history = History(3)
+    assert len(history) == 0
+    assert history.to_array().shape == (0, 5)
+
+    for i in range(3):
+        history.append((i, i, i, i, i))
+    assert len(history) == 3
+    assert history.to_array()[:, 0].tolist() == [0, 1, 2]
+
+
+def test_history_wraps_around():
+    history = History(4)
+    for i in range(6):
+        history.append((i, i, i, i, i))
+    assert len(history) == 4
+    assert history.to_array()[:, 0].tolist() == [2, 3, 4, 5]
+
+
+def test_plot_stats(tmp_path):
+    output_file = tmp_path / 'plot.png'
+    data_points = [
+        (0.0, 100.0, 0.0, 1.0, 0.5),
+        (1.0, 120.0, 70.0, 1.5, 0.75),
+    ]
+    plot_stats(data_points, str(output_file))
+    assert output_file.exists()
+    assert [p.name for p in tmp_path.iterdir()] == ['plot.png']
+
+
+def test_plot_stats_reuses_figure(tmp_path):
+    data_points = [
+        (0.0, 100.0, 0.0, 1.0, 0.5),
+        (1.0, 120.0, 70.0, 1.5, 0.75),
+    ]
+    plot_stats(data_points, str(tmp_path / 'plot1.png'))
+    fig = _get_figure()
+    plot_stats(data_points[:1], str(tmp_path / 'plot2.png'))
+    assert _get_figure() is fig
+    assert (tmp_path / 'plot2.png').exists()
+    assert [len(ax.lines) for ax in fig.axes] == [1, 1, 2]
+
+
+def test_plot_stats_downsamples(tmp_path):
+    n = 10000
+    data_points = np.zeros((n, 5))
+    data_points[:, 0] = np.arange(n) / 10
+    plot_stats(data_points, str(tmp_path / 'plot.png'), max_points=100)
+    for ax in _get_figure().axes:
+        for line in ax.lines:
+            assert len(line.get_xdata()) == 100
+
+
+@pytest.mark.parametrize("n", [50, 500, 5000])
+def test_lttb(n):
+    x = np.arange(n, dtype=np.float64)
+    y = np.sin(x / 10)
+    y[n // 3] = 10.0  # Spike
+
+    indices = _lttb(x, y, 40)
+    assert len(indices) == 40
+    assert indices[0] == 0
+    assert indices[-1] == n - 1
+    assert np.all(np.diff(indices) > 0)
+    assert n // 3 in indices
+
+
+def test_lttb_short_series():
+    x = np.arange(10, dtype=np.float64)
+    assert _lttb(x, x, 40).tolist() == list(range(10))
 
 
 if __name__ == '__main__':